@@ -1,113 +1,417 @@
+import asyncio
 import io
+import os
 import time
+import random
 import socket
-from tempfile import TemporaryFile
+import threading
+from collections.abc import Mapping
+from dataclasses import dataclass, fields, is_dataclass, replace
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, get_args
 
-from pydantic import BaseModel, Field
+from smb.base import NotConnectedError, NotReadyError, OperationFailure, SMBTimeout
 from smb.SMBConnection import SMBConnection
 
+# ошибки, после которых подключение считается потерянным
+_TRANSPORT_ERRORS = (OSError, NotConnectedError, NotReadyError, SMBTimeout)
 
-class MasterNode(BaseModel):
-    host: str = Field(None, description="SMB хост")
-    service_name: str = Field(None, description="Сервис")
-    username: str = Field(None, description="Имя пользователя")
-    password: str = Field(None, description="Пароль")
 
+class _OffsetWriter:
+    """
+    Файлоподобный объект, который пишет в файловый дескриптор начиная с заданного смещения
+    """
+    def __init__(self, fd: int, offset: int):
+        self.fd = fd
+        self.offset = offset
 
-class BackupNode(BaseModel):
-    host: str = Field(None, description="SMB хост")
-    service_name: str = Field(None, description="Сервис")
-    username: str = Field(None, description="Имя пользователя")
-    password: str = Field(None, description="Пароль")
+    def write(self, data) -> int:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset)
+            self.offset += written
+            view = view[written:]
+        return len(data)
 
 
-class SMBConfig(BaseModel):
-    master_node: MasterNode = Field(None, description="Конфигурация основного подключения")
-    backup_node: BackupNode = Field(None, description="Конфигурация запасного подключения")
-    reconnect_wait_time: int = Field(None, description="Время ожидания переподключения в секундах")
-    reconnect_attempts: int = Field(None, description="Количество попыток переподключения")
+@dataclass(slots=True, frozen=True)
+class MasterNode:
+    host: str | None = None  # SMB хост
+    service_name: str | None = None  # Сервис
+    username: str | None = None  # Имя пользователя
+    password: str | None = None  # Пароль
+
+
+@dataclass(slots=True, frozen=True)
+class BackupNode:
+    host: str | None = None  # SMB хост
+    service_name: str | None = None  # Сервис
+    username: str | None = None  # Имя пользователя
+    password: str | None = None  # Пароль
+
+
+@dataclass(slots=True, frozen=True)
+class SMBConfig:
+    master_node: MasterNode | None = None  # Конфигурация основного подключения
+    backup_node: BackupNode | None = None  # Конфигурация запасного подключения
+    reconnect_wait_time: int | None = None  # Время ожидания переподключения в секундах
+    reconnect_attempts: int | None = None  # Количество попыток переподключения
+    base_delay: float | None = None  # Базовая задержка между попытками переподключения в секундах, по умолчанию reconnect_wait_time
+    max_delay: float = 30.0  # Максимальная задержка между попытками переподключения в секундах
+    connect_timeout: int = 10  # Таймаут подключения к узлу в секундах
+    resolve_ttl: float = 300.0  # Время кеширования IP адресов узлов в секундах
+    master_head_start: float = 2.0  # Время в секундах, которое основной узел подключается один, прежде чем параллельно подключаться к запасному
+    breaker_cooldown: float = 30.0  # Минимальное время в секундах, на которое недоступный основной узел исключается из подключения
+    health_check_ttl: float = 30.0  # Время в секундах, в течение которого подключение считается живым после успешной операции
+    ls_cache_ttl: float = 5.0  # Время кеширования списка файлов директории в секундах
+    ls_cache_size: int = 1024  # Максимальное количество закешированных списков файлов
+    mem_threshold: int = 8 * 1024 * 1024  # Размер файла в байтах, до которого скачивание идет в память, а не во временный файл
+    stripe_threshold: int = 64 * 1024 * 1024  # Размер файла в байтах, начиная с которого остаток файла скачивается параллельно
+    stripe_workers: int = 4  # Количество потоков для параллельного скачивания больших файлов
+
+
+def _build(cls, data):
+    """
+    Создать dataclass конфигурации из словаря, приведя значения к типам полей
+    :param cls: класс конфигурации
+    :param data: словарь или уже готовый экземпляр cls
+    :return: экземпляр cls
+    """
+    if data is None or isinstance(data, cls):
+        return data
+    if not isinstance(data, Mapping):
+        raise TypeError(f"{cls.__name__}: expected a mapping, got {type(data).__name__}")
+    values = {}
+    for field in fields(cls):
+        if field.name not in data:
+            continue
+        value = data[field.name]
+        if value is not None:
+            field_type = next(t for t in get_args(field.type) or (field.type,) if t is not type(None))
+            if is_dataclass(field_type):
+                value = _build(field_type, value)
+            elif field_type is int and isinstance(value, float) and not value.is_integer():
+                # int() молча отбросил бы дробную часть
+                raise ValueError(f"{cls.__name__}.{field.name}: expected an integer, got {value!r}")
+            else:
+                value = field_type(value)
+        values[field.name] = value
+    return cls(**values)
+
+
+def _parse(cfg: dict) -> SMBConfig:
+    """
+    Разобрать конфигурацию клиента; типы приводятся один раз при создании SMB
+    :param cfg: словарь с конфигурацией
+    :return: SMBConfig
+    """
+    cfg = _build(SMBConfig, cfg)
+    if cfg.base_delay is None:
+        # в существующих конфигурациях задано только reconnect_wait_time, он становится базовой задержкой
+        cfg = replace(cfg, base_delay=float(cfg.reconnect_wait_time) if cfg.reconnect_wait_time is not None else 1.0)
+    return cfg
 
 
 class SMB:
     def __init__(self, cfg, log):
         self.log = log
-        self.cfg = SMBConfig(**cfg)
-        self.current_connection: SMBConnection | None = None
-        self.service_name = ""
+        self.cfg = _parse(cfg)
+        # pysmb SMBConnection не потокобезопасен, поэтому у каждого потока свое подключение
+        # для каждого подключения хранится признак того, что оно установлено с основным узлом
+        self._conns: dict[int, tuple[SMBConnection, bool]] = {}
+        self._conns_lock = threading.Lock()
+        self._stripe_executor: ThreadPoolExecutor | None = None
+        self._last_ok_ts = 0.0
+        self._master_open_until = 0.0
+        self._local_hostname = socket.gethostname()
+        self._resolved: dict[str, tuple[float, str]] = {}
+        self._tree_connected: dict[tuple[str, str], float] = {}
+        self._ls_cache: dict[tuple[str, str, str], tuple[float, list, frozenset]] = {}
         self.connect()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def __del__(self):
-        self.current_connection.close()
-        self.current_connection = None
+        # __init__ мог упасть до создания пула подключений, а при завершении интерпретатора часть модулей уже выгружена
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Закрыть подключения всех потоков
+        :return:
+        """
+        with self._conns_lock:
+            executor, self._stripe_executor = self._stripe_executor, None
+        if executor is not None:
+            executor.shutdown()
+        with self._conns_lock:
+            conns = [conn for conn, _ in self._conns.values()]
+            self._conns.clear()
+        for conn in conns:
+            self._drop(conn)
 
     def connect(self):
-        def __connect_master():
-            try:
-                connection = SMBConnection(self.cfg.master_node.username, self.cfg.master_node.password, socket.gethostname(),
-                                           self.cfg.master_node.host, domain="group.s7", use_ntlm_v2=True, is_direct_tcp=True)
-                connection.connect(socket.gethostbyname(self.cfg.master_node.host), 445)
-                try:
-                    connection.listPath(self.cfg.master_node.service_name, "")
-                    self.current_connection = connection
-                    self.service_name = self.cfg.master_node.service_name
-                except Exception as err:
-                    raise err
-                return True
-            except Exception as err:
-                self.log.error(err)
-                return False
+        """
+        Установить подключение для текущего потока, если его еще нет
+        :return:
+        """
+        self._conn()
 
-        def __connect_backup():
-            try:
-                connection = SMBConnection(self.cfg.backup_node.username, self.cfg.backup_node.password, socket.gethostname(),
-                                           self.cfg.backup_node.host, domain="group.s7", use_ntlm_v2=True, is_direct_tcp=True)
-                connection.connect(socket.gethostbyname(self.cfg.backup_node.host), 445)
-                try:
-                    connection.listPath(self.cfg.backup_node.service_name, "")
-                    self.current_connection = connection
-                    self.service_name = self.cfg.backup_node.service_name
-                except Exception as err:
-                    raise err
-                return True
-            except Exception as err:
-                self.log.error(err)
-                return False
+    def _conn(self, node: MasterNode | BackupNode | None = None) -> tuple[SMBConnection, str]:
+        ident = threading.get_ident()
+        with self._conns_lock:
+            entry = self._conns.get(ident)
+        if entry is not None and node is not None and entry[1] != (node is self.cfg.master_node):
+            # операция должна идти на конкретный узел, а поток подключен к другому
+            self._discard()
+            entry = None
+        if entry is None:
+            entry = self._new_connection(node)
+            # новое подключение могло уйти на другой узел, списки файлов старого узла больше не актуальны
+            self._ls_cache.clear()
+            with self._conns_lock:
+                self._conns[ident] = entry
+                # подключения завершившихся потоков больше никто не использует, закрываем их
+                alive = {thread.ident for thread in threading.enumerate()}
+                dead = [self._conns.pop(key) for key in list(self._conns) if key not in alive]
+            for conn, _ in dead:
+                self._drop(conn)
+        conn, is_master = entry
+        node = self.cfg.master_node if is_master else self.cfg.backup_node
+        return conn, node.service_name
+
+    def _current_node(self) -> MasterNode | BackupNode:
+        with self._conns_lock:
+            entry = self._conns.get(threading.get_ident())
+        if entry is None:
+            raise ConnectionError("not available connection")
+        return self.cfg.master_node if entry[1] else self.cfg.backup_node
+
+    def _discard(self):
+        with self._conns_lock:
+            entry = self._conns.pop(threading.get_ident(), None)
+        if entry is not None:
+            self._drop(entry[0])
+
+    @staticmethod
+    def _drop(conn: SMBConnection):
+        # экземпляры SMBConnection не переиспользуются: старое подключение закрывается, вместо него создается новое
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _resolve(self, host: str) -> str:
+        cached = self._resolved.get(host)
+        if cached is not None and time.monotonic() - cached[0] < self.cfg.resolve_ttl:
+            return cached[1]
+        ip = socket.gethostbyname(host)
+        self._resolved[host] = (time.monotonic(), ip)
+        return ip
 
+    def _try_connect(self, node: MasterNode | BackupNode) -> SMBConnection | None:
+        """
+        Подключиться к узлу и проверить доступность сервиса
+        :param node: конфигурация основного или запасного узла
+        :return: подключение или None, если узел недоступен
+        """
+        connection = None
+        try:
+            connection = SMBConnection(node.username, node.password, self._local_hostname,
+                                       node.host, domain="group.s7", use_ntlm_v2=True, is_direct_tcp=True)
+            if not connection.connect(self._resolve(node.host), 445, timeout=self.cfg.connect_timeout):
+                # pysmb при неудачной аутентификации не бросает исключение, а возвращает False
+                raise NotReadyError(f"authentication failed on {node.host}")
+            share = (node.host, node.service_name)
+            # доступность сервиса проверяем, только если он давно не подтверждался другим подключением
+            verified = self._tree_connected.get(share)
+            if verified is None or time.monotonic() - verified >= self.cfg.health_check_ttl:
+                connection.listPath(node.service_name, "")
+                self._tree_connected[share] = time.monotonic()
+            self._last_ok_ts = time.monotonic()
+            if node is self.cfg.master_node:
+                self._master_open_until = 0.0
+            return connection
+        except Exception as err:
+            self.log.error(err)
+            if node is self.cfg.master_node:
+                # основной узел недоступен: какое-то время не пытаемся к нему подключаться,
+                # окно со случайным разбросом, чтобы воркеры не возвращались к нему одновременно
+                self._master_open_until = time.monotonic() + self.cfg.breaker_cooldown * random.uniform(1, 2)
+            self._tree_connected.pop((node.host, node.service_name), None)
+            if isinstance(err, OSError):
+                # сетевая ошибка: адрес узла мог смениться, перед следующей попыткой резолвим заново
+                self._resolved.pop(node.host, None)
+            if connection is not None:
+                self._drop(connection)
+            return None
+
+    def _new_connection(self, node: MasterNode | BackupNode | None = None) -> tuple[SMBConnection, bool]:
         try_count: int = 1
-        while not self.current_connection:
-            if try_count >= self.cfg.reconnect_attempts:
-                self.log.info(
-                    f"failed to connect to {self.cfg.master_node.host}:{self.cfg.master_node.service_name} try connect to {self.cfg.backup_node.host}:{self.cfg.backup_node.service_name}")
-                if __connect_backup():
-                    self.log.info(f"successfully connected to {self.cfg.backup_node.host}:{self.cfg.backup_node.username}")
-            elif __connect_master():
-                self.log.info(f"successfully connected to {self.cfg.master_node.host}:{self.cfg.master_node.service_name}")
+        while True:
+            if node is None:
+                entry = self._race()
             else:
-                self.log.error(f"failed to connect to {self.cfg.master_node.host}:{self.cfg.master_node.service_name}. try reconnecting...")
+                connection = self._try_connect(node)
+                entry = (connection, node is self.cfg.master_node) if connection else None
+            if entry:
+                return entry
+            self.log.error(
+                f"failed to connect to {self.cfg.master_node.host}:{self.cfg.master_node.service_name} and {self.cfg.backup_node.host}:{self.cfg.backup_node.service_name}. try reconnecting...")
+            if try_count >= self.cfg.reconnect_attempts:
+                raise ConnectionError("not available connection")
+            # экспоненциальная задержка с full jitter, степень ограничена во избежание переполнения float
+            delay = random.uniform(0, min(self.cfg.max_delay, self.cfg.base_delay * (2 ** min(try_count - 1, 32))))
             try_count += 1
-            time.sleep(self.cfg.reconnect_wait_time)
+            time.sleep(delay)
+
+    def _race(self) -> tuple[SMBConnection, bool] | None:
+        """
+        Подключиться к основному узлу, а если он упал или не ответил за master_head_start секунд,
+        параллельно подключаться к запасному и взять первое живое подключение
+        :return: пара (подключение, признак основного узла) или None, если оба узла недоступны
+        """
+        master, backup = self.cfg.master_node, self.cfg.backup_node
+        executor = ThreadPoolExecutor(max_workers=2)
+        futures = {}
+        try:
+            master_skipped = time.monotonic() < self._master_open_until
+            if master_skipped:
+                self.log.info(f"{master.host}:{master.service_name} is marked as unavailable, skip it")
+            else:
+                futures[executor.submit(self._try_connect, master)] = master
+                wait(futures, timeout=self.cfg.master_head_start)
+            winner = self._winner(futures)
+            if winner is None:
+                futures[executor.submit(self._try_connect, backup)] = backup
+                pending = {future for future in futures if not future.done()}
+                while winner is None and pending:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    winner = self._winner(futures)
+            if winner is None and master_skipped:
+                # запасной узел тоже недоступен: пробуем основной, он мог уже восстановиться
+                master_future = executor.submit(self._try_connect, master)
+                futures[master_future] = master
+                wait([master_future])
+                winner = self._winner(futures)
+            if winner is None:
+                return None
+            for future in futures:
+                if future is not winner:
+                    future.add_done_callback(self._drop_result)
+            node = futures[winner]
+            self.log.info(f"successfully connected to {node.host}:{node.service_name}")
+            return winner.result(), node is master
+        finally:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _winner(futures: dict) -> Future | None:
+        # основной узел идет в словаре первым, поэтому если оба подключились, предпочитаем его
+        return next((future for future in futures if future.done() and future.result()), None)
+
+    def _drop_result(self, future: Future):
+        connection = future.result()
+        if connection is not None:
+            self._drop(connection)
 
     def check_connection(self):
-        if self.current_connection.remote_name.upper() == self.cfg.master_node.host.upper():
+        if time.monotonic() - self._last_ok_ts < self.cfg.health_check_ttl:
+            return True
+        try:
+            conn, service = self._conn()
+        except ConnectionError:
+            return False
+        try:
+            conn.listPath(service, "")
+            self._last_ok_ts = time.monotonic()
+            return True
+        except Exception as err:
+            self.log.error(err)
+            self._discard()
             try:
-                self.current_connection.listPath(self.cfg.master_node.service_name, "")
-                return True
-            except Exception as err:
-                self.current_connection = None
                 self.connect()
-                if self.current_connection:
-                    return True
+            except ConnectionError:
                 return False
-        elif self.current_connection.remote_name.upper() == self.cfg.backup_node.host.upper():
+            return True
+
+    def _with_retry(self, op, idempotent: bool = True, node: MasterNode | BackupNode | None = None):
+        """
+        Выполнить операцию над подключением текущего потока, при сетевой ошибке переподключиться и повторить один раз
+        :param op: функция от (подключение, имя сервиса), выполняющая SMB операцию
+        :param idempotent: можно ли безопасно повторить операцию, если первый вызов мог выполниться на сервере
+        :param node: узел, на котором обязательно выполнять операцию; по умолчанию любой доступный
+        :return: результат op
+        """
+        conn, service = self._conn(node)
+        try:
+            result = op(conn, service)
+        except _TRANSPORT_ERRORS as err:
+            # переподключаемся только при обрыве связи; ошибки сервера (OperationFailure) и ошибки
+            # вызывающего кода пробрасываются как есть, подключение при этом живое
+            self.log.error(err)
+            self._discard()
+            conn, service = self._conn(node)
+            result = self._replay(op, conn, service, err, idempotent)
+        self._last_ok_ts = time.monotonic()
+        return result
+
+    def _replay(self, op, conn: SMBConnection, service: str, err: Exception, idempotent: bool):
+        try:
+            return op(conn, service)
+        except OperationFailure:
+            # NotConnectedError означает, что запрос не был отправлен; при остальных ошибках (таймаут, обрыв)
+            # первый вызов мог успеть выполниться, и повтор rename/delete падает как раз потому, что работа сделана
+            if idempotent or isinstance(err, NotConnectedError):
+                raise
+            self.log.info(f"retry after {err!r} failed on server side, treat the first attempt as successful")
+            return None
+
+    def _batch(self, items: list, op, idempotent: bool = True) -> list:
+        """
+        Выполнить операцию для каждого элемента через одно подключение текущего потока,
+        при сетевой ошибке переподключиться и повторить элемент один раз
+        :param items: список элементов
+        :param op: функция от (подключение, имя сервиса, элемент), выполняющая SMB операцию
+        :param idempotent: можно ли безопасно повторить операцию, если первый вызов мог выполниться на сервере
+        :return: список элементов, для которых операция завершилась ошибкой
+        """
+        failed = []
+        try:
+            conn, service = self._conn()
+        except ConnectionError as err:
+            self.log.error(err)
+            return list(items)
+        for index, item in enumerate(items):
             try:
-                self.current_connection.listPath(self.cfg.backup_node.service_name, "")
-                return True
+                op(conn, service, item)
+            except _TRANSPORT_ERRORS as err:
+                self.log.error(err)
+                self._discard()
+                try:
+                    conn, service = self._conn()
+                except ConnectionError as conn_err:
+                    self.log.error(conn_err)
+                    failed.extend(items[index:])
+                    return failed
+                try:
+                    self._replay(lambda c, s: op(c, s, item), conn, service, err, idempotent)
+                except Exception as replay_err:
+                    self.log.error(replay_err)
+                    failed.append(item)
             except Exception as err:
-                self.current_connection = None
-                self.connect()
-                if self.current_connection:
-                    return True
-                return False
+                self.log.error(err)
+                failed.append(item)
+        self._last_ok_ts = time.monotonic()
+        return failed
 
     def ls(self, dir_path: str, regex="*", sort_order="desc") -> list:
         """
@@ -117,13 +421,39 @@ class SMB:
         :param sort_order: порядок сортировки ('asc' - по возрастанию, 'desc' - по убыванию)
         :return: список имен файлов в указанной директории
         """
-        if self.check_connection():
-            files_list = self.current_connection.listPath(self.service_name, dir_path, pattern=regex)
-            files_list.sort(key=lambda x: x.create_time, reverse=(sort_order == "desc"))
-            filenames_list = [file.filename for file in files_list]
-            return filenames_list
-        else:
-            raise Exception("not available connection")
+        return list(self._listing(dir_path, regex, sort_order)[1])
+
+    def _listing(self, dir_path: str, regex="*", sort_order="desc") -> tuple[float, list, frozenset]:
+        key = (self._dir_key(dir_path), regex, sort_order)
+        cached = self._ls_cache.get(key)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < self.cfg.ls_cache_ttl:
+            return cached
+        files_list = self._with_retry(lambda conn, service: conn.listPath(service, dir_path, pattern=regex))
+        files_list.sort(key=lambda x: x.create_time, reverse=(sort_order == "desc"))
+        filenames_list = [file.filename for file in files_list]
+        entry = (time.monotonic(), filenames_list, frozenset(filenames_list))
+        # устаревшие записи удаляем сразу, а при переполнении вытесняем самые старые
+        for stale in [k for k, v in list(self._ls_cache.items()) if now - v[0] >= self.cfg.ls_cache_ttl]:
+            self._ls_cache.pop(stale, None)
+        while len(self._ls_cache) >= self.cfg.ls_cache_size:
+            # кеш общий для потоков и может быть очищен между проверкой размера и выбором ключа
+            oldest = next(iter(self._ls_cache), None)
+            if oldest is None:
+                break
+            self._ls_cache.pop(oldest, None)
+        self._ls_cache[key] = entry
+        return entry
+
+    @staticmethod
+    def _dir_key(dir_path: str) -> str:
+        return dir_path.replace("\\", "/").strip("/")
+
+    def _invalidate_ls(self, dir_path: str):
+        dir_key = self._dir_key(dir_path)
+        for key in list(self._ls_cache):
+            if key[0] == dir_key:
+                self._ls_cache.pop(key, None)
 
     def check_file_in_directory(self, dir_path: str, file_name: str) -> bool:
         """
@@ -132,9 +462,7 @@ class SMB:
         :param file_name: имя проверяемого файла
         :return: bool
         """
-        if not self.check_connection():
-            self.connect()
-        return file_name in self.ls(dir_path)
+        return file_name in self._listing(dir_path)[2]
 
     def upload_bytes(self, dir_path: str, file_name: str, payload: io.BytesIO):
         """
@@ -144,33 +472,128 @@ class SMB:
         :param payload: io.BytesIO("test".encode("utf-8"))
         :return:
         """
+        start = payload.tell()
+
+        def store(conn, service):
+            payload.seek(start)
+            return conn.storeFile(service, f"{dir_path}/{file_name}", payload)
+
         try:
-            if not self.check_connection():
-                self.connect()
-            self.current_connection.storeFile(self.service_name, f"{dir_path}/{file_name}", payload)
+            self._with_retry(store)
             return True
         except Exception as err:
             self.log.error(err)
             return False
+        finally:
+            self._invalidate_ls(dir_path)
+
+    def upload_many(self, dir_path: str, items: list[tuple[str, io.BytesIO]]) -> list[str]:
+        """
+        Загрузить несколько файлов в директорию через одно подключение
+        :param dir_path: путь до директории
+        :param items: список пар (имя загружаемого файла, io.BytesIO)
+        :return: список имен файлов, которые не удалось загрузить
+        """
+        prefix = dir_path + "/"
+
+        def store(conn, service, item):
+            file_name, payload, start = item
+            payload.seek(start)
+            conn.storeFile(service, prefix + file_name, payload)
+
+        try:
+            failed = self._batch([(file_name, payload, payload.tell()) for file_name, payload in items], store)
+        finally:
+            self._invalidate_ls(dir_path)
+        return [file_name for file_name, _, _ in failed]
 
-    def download_bytes(self, dir_path: str, file_name: str) -> io.BufferedRandom:
+    def download_bytes(self, dir_path: str, file_name: str) -> BinaryIO:
         """
         Загрузить файл из директории в io.BytesIO
         :param dir_path: путь до директории
         :param file_name: имя загружаемого файла
         :return: io.BytesIO("test".encode("utf-8"))
         """
+        path = f"{dir_path}/{file_name}"
+
+        def retrieve(conn, service):
+            # небольшие файлы остаются в памяти, на диск выгружаются только файлы больше mem_threshold
+            file_data = SpooledTemporaryFile(max_size=self.cfg.mem_threshold)
+            try:
+                # первый блок читается как обычно; если файл в него уместился, лишних запросов не будет
+                _, read = conn.retrieveFileFromOffset(service, path, file_data, 0, self.cfg.stripe_threshold)
+            except Exception:
+                file_data.close()
+                raise
+            return file_data, read
+
         try:
-            if not self.check_connection():
-                self.connect()
-            file_data = TemporaryFile()
-            self.current_connection.retrieveFile(self.service_name, f"{dir_path}/{file_name}", file_data)
+            file_data, read = self._with_retry(retrieve)
+            try:
+                if read >= self.cfg.stripe_threshold:
+                    # остаток читается с того же узла, что и первый блок, иначе файл соберется из разных копий
+                    self._download_rest(path, file_data, read, self._current_node())
+            except Exception:
+                file_data.close()
+                raise
             file_data.seek(0)
             return file_data
         except Exception as err:
             self.log.error(err)
             raise err
 
+    def _download_rest(self, path: str, file_data: BinaryIO, offset: int, node: MasterNode | BackupNode):
+        """
+        Докачать большой файл начиная со смещения offset, разбив остаток на диапазоны и читая их параллельно
+        :param path: путь до файла
+        :param file_data: файл, в который уже записаны первые offset байт
+        :param offset: смещение, с которого нужно продолжить чтение
+        :param node: узел, с которого прочитан первый блок
+        :return:
+        """
+        file_size = self._with_retry(lambda conn, service: conn.getAttributes(service, path), node=node).file_size
+        if file_size <= offset:
+            return
+        if self.cfg.stripe_workers <= 1 or not hasattr(os, "pwrite"):
+            def retrieve_tail(conn, service):
+                # при повторе после обрыва дописываем не в конец частично прочитанных данных, а с offset
+                file_data.seek(offset)
+                file_data.truncate()
+                return conn.retrieveFileFromOffset(service, path, file_data, offset)
+
+            self._with_retry(retrieve_tail, node=node)
+            return
+
+        file_data.flush()
+        fd = file_data.fileno()
+        file_data.truncate(file_size)
+        chunk = -(-(file_size - offset) // self.cfg.stripe_workers)
+
+        def retrieve_range(start, length):
+            # каждый поток пула работает через свое подключение и пишет в свой диапазон файла
+            return self._with_retry(
+                lambda conn, service: conn.retrieveFileFromOffset(service, path, _OffsetWriter(fd, start), start, length),
+                node=node)
+
+        executor = self._stripe_pool()
+        futures = [executor.submit(retrieve_range, start, min(chunk, file_size - start))
+                   for start in range(offset, file_size, chunk)]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = next((future for future in futures if future in done and future.exception() is not None), None)
+        if failed is not None:
+            # остальные диапазоны пишут в fd файла напрямую: пока они не завершились, закрывать файл нельзя,
+            # иначе номер fd может достаться другому файлу и данные запишутся в него
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise failed.exception()
+
+    def _stripe_pool(self) -> ThreadPoolExecutor:
+        with self._conns_lock:
+            if self._stripe_executor is None:
+                self._stripe_executor = ThreadPoolExecutor(max_workers=self.cfg.stripe_workers, thread_name_prefix="smb-stripe")
+            return self._stripe_executor
+
     def delete_file(self, dir_path: str, file_name: str):
         """
         Удалить файл из директории
@@ -179,13 +602,27 @@ class SMB:
         :return:
         """
         try:
-            if not self.check_connection():
-                self.connect()
-            self.current_connection.deleteFiles(self.service_name, f"{dir_path}/{file_name}")
+            self._with_retry(lambda conn, service: conn.deleteFiles(service, f"{dir_path}/{file_name}"), idempotent=False)
             return True
         except Exception as err:
             self.log.error(err)
             return False
+        finally:
+            self._invalidate_ls(dir_path)
+
+    def delete_many(self, dir_path: str, names: list[str]) -> list[str]:
+        """
+        Удалить несколько файлов из директории через одно подключение
+        :param dir_path: путь до директории
+        :param names: список имен удаляемых файлов
+        :return: список имен файлов, которые не удалось удалить
+        """
+        prefix = dir_path + "/"
+        try:
+            return self._batch(names, lambda conn, service, file_name: conn.deleteFiles(service, prefix + file_name),
+                               idempotent=False)
+        finally:
+            self._invalidate_ls(dir_path)
 
     def move_file(self, path_from: str, path_to: str):
         """
@@ -195,10 +632,59 @@ class SMB:
         :return:
         """
         try:
-            if not self.check_connection():
-                self.connect()
-            self.current_connection.rename(self.service_name, f"{path_from}", f"{path_to}")
+            self._with_retry(lambda conn, service: conn.rename(service, f"{path_from}", f"{path_to}"), idempotent=False)
             return True
         except Exception as err:
             self.log.error(err)
             return False
+        finally:
+            self._invalidate_ls(self._dir_key(path_from).rpartition("/")[0])
+            self._invalidate_ls(self._dir_key(path_to).rpartition("/")[0])
+
+    async def ls_async(self, dir_path: str, regex="*", sort_order="desc") -> list:
+        """
+        Асинхронная версия ls, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.ls, dir_path, regex, sort_order)
+
+    async def check_file_in_directory_async(self, dir_path: str, file_name: str) -> bool:
+        """
+        Асинхронная версия check_file_in_directory, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.check_file_in_directory, dir_path, file_name)
+
+    async def upload_bytes_async(self, dir_path: str, file_name: str, payload: io.BytesIO):
+        """
+        Асинхронная версия upload_bytes, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.upload_bytes, dir_path, file_name, payload)
+
+    async def upload_many_async(self, dir_path: str, items: list[tuple[str, io.BytesIO]]) -> list[str]:
+        """
+        Асинхронная версия upload_many, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.upload_many, dir_path, items)
+
+    async def download_bytes_async(self, dir_path: str, file_name: str) -> BinaryIO:
+        """
+        Асинхронная версия download_bytes, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.download_bytes, dir_path, file_name)
+
+    async def delete_file_async(self, dir_path: str, file_name: str):
+        """
+        Асинхронная версия delete_file, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.delete_file, dir_path, file_name)
+
+    async def delete_many_async(self, dir_path: str, names: list[str]) -> list[str]:
+        """
+        Асинхронная версия delete_many, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.delete_many, dir_path, names)
+
+    async def move_file_async(self, path_from: str, path_to: str):
+        """
+        Асинхронная версия move_file, выполняется в отдельном потоке со своим подключением
+        """
+        return await asyncio.to_thread(self.move_file, path_from, path_to)
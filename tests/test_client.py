@@ -0,0 +1,297 @@
+import io
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from smb.base import NotConnectedError, OperationFailure, SMBTimeout
+
+from smbclient import client
+from smbclient.client import SMB
+
+MASTER_DATA = bytes(range(256)) * 3
+BACKUP_DATA = b"\x00" * len(MASTER_DATA)
+
+
+class FakeConnection:
+    """
+    Подмена pysmb SMBConnection: у каждого хоста свой набор файлов
+    """
+    files: dict[str, dict[str, bytes]] = {}
+    down: set[str] = set()
+    read_failures: list = []
+    # ошибки для следующих rename/deleteFiles: ("before", exc) - запрос не дошел, ("after", exc) - потерян ответ
+    op_failures: list = []
+    connects: list = []
+    auth_fail: set[str] = set()
+    range_hooks: dict = {}
+    finished_ranges: list = []
+
+    def __init__(self, username, password, my_name, remote_name, domain="", use_ntlm_v2=True, is_direct_tcp=False):
+        self.remote_name = remote_name
+
+    def connect(self, ip, port=139, sock_family=None, timeout=60):
+        self.connects.append(self.remote_name)
+        if self.remote_name in self.down:
+            raise ConnectionRefusedError(f"{self.remote_name} is down")
+        return self.remote_name not in self.auth_fail
+
+    def _server_op(self, action):
+        when, err = self.op_failures.pop(0) if self.op_failures else (None, None)
+        if when == "before":
+            raise err
+        action()
+        if when == "after":
+            raise err
+
+    def rename(self, service_name, old_path, new_path):
+        files = self.files[self.remote_name]
+
+        def move():
+            if old_path not in files:
+                raise OperationFailure(f"{old_path} not found", [])
+            files[new_path] = files.pop(old_path)
+
+        self._server_op(move)
+
+    def deleteFiles(self, service_name, path_file_pattern):
+        files = self.files[self.remote_name]
+
+        def delete():
+            if path_file_pattern not in files:
+                raise OperationFailure(f"{path_file_pattern} not found", [])
+            del files[path_file_pattern]
+
+        self._server_op(delete)
+
+    def storeFile(self, service_name, path, file_obj):
+        self.files[self.remote_name][path] = file_obj.read()
+
+    def listPath(self, service_name, path, pattern="*"):
+        prefix = path.strip("/") + "/"
+        return [SimpleNamespace(filename=name[len(prefix):], create_time=0)
+                for name in self.files[self.remote_name] if path and name.startswith(prefix)]
+
+    def getAttributes(self, service_name, path):
+        return SimpleNamespace(file_size=len(self.files[self.remote_name][path]))
+
+    def retrieveFileFromOffset(self, service_name, path, file_obj, offset=0, max_length=-1, timeout=30):
+        data = self.files[self.remote_name][path]
+        end = len(data) if max_length < 0 else min(len(data), offset + max_length)
+        hook = self.range_hooks.get(offset)
+        if hook is not None:
+            hook()
+        if offset > 0 and self.read_failures:
+            # обрыв связи посреди чтения: часть данных уже записана
+            self.read_failures.pop()
+            file_obj.write(data[offset:offset + 40])
+            raise ConnectionResetError("connection reset by peer")
+        file_obj.write(data[offset:end])
+        self.finished_ranges.append(offset)
+        return 0, end - offset
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_smb(monkeypatch):
+    FakeConnection.files = {"master": {"dir/file": MASTER_DATA}, "backup": {"dir/file": BACKUP_DATA}}
+    FakeConnection.down = set()
+    FakeConnection.read_failures = []
+    FakeConnection.op_failures = []
+    FakeConnection.connects = []
+    FakeConnection.auth_fail = set()
+    FakeConnection.range_hooks = {}
+    FakeConnection.finished_ranges = []
+    monkeypatch.setattr(client, "SMBConnection", FakeConnection)
+    monkeypatch.setattr(client.socket, "gethostbyname", lambda host: "127.0.0.1")
+
+    def make(**overrides):
+        cfg = {
+            "master_node": {"host": "master", "service_name": "share", "username": "u", "password": "p"},
+            "backup_node": {"host": "backup", "service_name": "share", "username": "u", "password": "p"},
+            "reconnect_attempts": 1,
+            "stripe_threshold": 256,
+            "stripe_workers": 3,
+        }
+        cfg.update(overrides)
+        return SMB(cfg, logging.getLogger("smbclient-test"))
+
+    return make
+
+
+def test_striped_download_reads_all_ranges_from_first_block_node(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+    FakeConnection.down = set()
+    # новое подключение без явного узла теперь ушло бы на запасной узел
+    smb._master_open_until = float("inf")
+    try:
+        assert smb.download_bytes("dir", "file").read() == MASTER_DATA
+    finally:
+        smb.close()
+
+
+def test_sequential_download_retry_rewrites_from_offset(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb(stripe_workers=1)
+    FakeConnection.read_failures = [True]
+    try:
+        assert smb.download_bytes("dir", "file").read() == MASTER_DATA
+    finally:
+        smb.close()
+
+
+def test_slow_master_within_head_start_wins_over_backup(fake_smb, monkeypatch):
+    connect = FakeConnection.connect
+
+    def slow_master_connect(self, *args, **kwargs):
+        if self.remote_name == "master":
+            time.sleep(0.2)
+        return connect(self, *args, **kwargs)
+
+    monkeypatch.setattr(FakeConnection, "connect", slow_master_connect)
+    attempted = []
+    monkeypatch.setattr(FakeConnection, "listPath", lambda self, *args, **kwargs: attempted.append(self.remote_name) or [])
+    smb = fake_smb()
+    try:
+        assert smb._current_node() is smb.cfg.master_node
+        assert attempted == ["master"]
+    finally:
+        smb.close()
+
+
+def test_backup_used_when_master_down(fake_smb):
+    FakeConnection.down = {"master"}
+    smb = fake_smb()
+    try:
+        assert smb._current_node() is smb.cfg.backup_node
+    finally:
+        smb.close()
+
+
+def test_ls_cache_serves_checks_and_stays_bounded(fake_smb, monkeypatch):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb(ls_cache_size=2)
+    calls = []
+    list_path = FakeConnection.listPath
+    monkeypatch.setattr(FakeConnection, "listPath",
+                        lambda self, service, path, pattern="*": calls.append(path) or list_path(self, service, path, pattern))
+    try:
+        assert smb.check_file_in_directory("dir", "file")
+        assert not smb.check_file_in_directory("dir", "other")
+        assert calls == ["dir"]
+        for path in ("a", "b", "c"):
+            smb.ls(path)
+        assert len(smb._ls_cache) == 2
+    finally:
+        smb.close()
+
+
+def test_config_rejects_fractional_integers_and_non_mapping_nodes():
+    assert client._parse({"reconnect_attempts": "3", "connect_timeout": 5.0}).connect_timeout == 5
+    with pytest.raises(ValueError):
+        client._parse({"reconnect_wait_time": 2.7})
+    with pytest.raises(TypeError):
+        client._parse({"master_node": "somestring"})
+
+
+def test_transport_error_reconnects_and_retries(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+    FakeConnection.op_failures = [("before", ConnectionResetError("connection reset by peer"))]
+    try:
+        assert smb.move_file("dir/file", "dir/moved")
+        assert "dir/moved" in FakeConnection.files["master"]
+        assert FakeConnection.connects == ["master", "master"]
+    finally:
+        smb.close()
+
+
+def test_caller_error_keeps_connection(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+    try:
+        # storeFile падает на read() из-за ошибки вызывающего кода, а не из-за связи
+        payload = io.BytesIO(b"data")
+        payload.read = None
+        assert not smb.upload_bytes("dir", "new", payload)
+        assert FakeConnection.connects == ["master"]
+    finally:
+        smb.close()
+
+
+def test_replay_of_done_rename_counts_as_success(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+    FakeConnection.op_failures = [("after", SMBTimeout())]
+    try:
+        assert smb.move_file("dir/file", "dir/moved")
+        assert "dir/moved" in FakeConnection.files["master"]
+    finally:
+        smb.close()
+
+
+def test_replay_failure_after_unsent_request_is_reported(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+    FakeConnection.op_failures = [("before", NotConnectedError())]
+    try:
+        assert not smb.delete_file("dir", "missing")
+    finally:
+        smb.close()
+
+
+def test_failed_range_waits_for_other_ranges_before_closing_file(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+
+    def fail():
+        raise OperationFailure("read failed", [])
+
+    # остаток 512 байт делится на диапазоны с началом 256, 427 и 598
+    FakeConnection.range_hooks = {256: fail, 427: lambda: time.sleep(0.3)}
+    try:
+        with pytest.raises(OperationFailure):
+            smb.download_bytes("dir", "file")
+        assert 427 in FakeConnection.finished_ranges
+    finally:
+        smb.close()
+
+
+def test_batch_reports_all_items_when_no_node_is_reachable(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+    smb.close()
+    FakeConnection.down = {"master", "backup"}
+    assert smb.delete_many("dir", ["file", "other"]) == ["file", "other"]
+
+
+def test_open_breaker_falls_back_to_master_when_backup_is_down(fake_smb):
+    FakeConnection.down = {"backup"}
+    smb = fake_smb()
+    # основной узел кратковременно пропадал, запасной по-прежнему недоступен
+    smb._master_open_until = time.monotonic() + 60
+    smb.close()
+    try:
+        assert smb.ls("dir") == ["file"]
+        assert smb._current_node() is smb.cfg.master_node
+        assert smb._master_open_until == 0.0
+    finally:
+        smb.close()
+
+
+def test_failed_authentication_is_not_accepted_while_share_is_warm(fake_smb):
+    smb = fake_smb()
+    FakeConnection.auth_fail = {"master"}
+    nodes = []
+    # новый поток создает свое подключение, пока проверка сервиса основного узла еще свежая
+    worker = threading.Thread(target=lambda: nodes.append((smb.ls("dir"), smb._current_node())))
+    worker.start()
+    worker.join()
+    try:
+        assert nodes == [(["file"], smb.cfg.backup_node)]
+    finally:
+        smb.close()